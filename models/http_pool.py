@@ -0,0 +1,78 @@
+import asyncio
+import logging
+from typing import Dict
+
+import aiohttp
+from bs4 import BeautifulSoup
+from pydantic import BaseModel, Field
+
+from models.profiler import Profiler
+
+logger = logging.getLogger(__name__)
+
+
+class HttpPool(BaseModel):
+    """Keeps the HTTP connection pool and the event loop alive between
+    law items so the connections to Eur-Lex are reused.
+
+    Pages are fetched with single-flight semantics: concurrent and
+    repeated requests for the same URL share one download. The parsed
+    pages are kept until the cache is cleared, which the scraper does
+    after every act, so the cache only ever holds the pages of one act."""
+
+    runner: asyncio.Runner = Field(default_factory=asyncio.Runner)
+    client_session: aiohttp.ClientSession | None = None
+    profiler: Profiler = Profiler()
+    in_flight: Dict[str, asyncio.Task] = {}
+    cache: Dict[str, BeautifulSoup] = {}
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def run(self, coroutine):
+        """Run the coroutine in the shared event loop"""
+        return self.runner.run(coroutine)
+
+    async def get_client_session(self) -> aiohttp.ClientSession:
+        # aiohttp sessions have to be created inside the event loop
+        if self.client_session is None or self.client_session.closed:
+            self.client_session = aiohttp.ClientSession()
+        return self.client_session
+
+    async def fetch_soup(self, url: str) -> BeautifulSoup | None:
+        """Return the parsed page or None if Eur-Lex did not return it"""
+        if url in self.cache:
+            logger.debug(f"Using cached {url}")
+            return self.cache[url]
+        task = self.in_flight.get(url)
+        if task is None:
+            task = asyncio.ensure_future(self.download(url=url))
+            self.in_flight[url] = task
+            task.add_done_callback(lambda _: self.in_flight.pop(url, None))
+        else:
+            logger.debug(f"Waiting for the download of {url} in flight")
+        # a cancelled waiter must not cancel the download for the others
+        return await asyncio.shield(task)
+
+    async def download(self, url: str) -> BeautifulSoup | None:
+        logger.info(f"Fetching {url}")
+        session = await self.get_client_session()
+        async with session.get(url) as response:
+            if response.status != 200:
+                # not cached so it is fetched again next time
+                logger.info(f"Got {response.status} from eur-lex for {url}")
+                return None
+            content = await response.text()
+        with self.profiler.allocations_in("beautifulsoup"):
+            soup = BeautifulSoup(content, "lxml")
+        self.cache[url] = soup
+        return soup
+
+    def clear_cache(self):
+        """Forget the parsed pages, they are only needed while working on one act"""
+        self.cache.clear()
+
+    def close(self):
+        if self.client_session is not None:
+            self.run(self.client_session.close())
+        self.runner.close()
@@ -1,11 +1,8 @@
 import logging
 from typing import List, Set, Pattern
 
-import aiohttp
 import asyncio
-import requests
-from bs4 import BeautifulSoup, SoupStrainer
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from wikibaseintegrator import WikibaseIntegrator
 from wikibaseintegrator.datatypes import URL, Time, MonolingualText, Item
 from wikibaseintegrator.entities import ItemEntity
@@ -13,7 +10,10 @@ from wikibaseintegrator.models import Reference, References, Claim
 from wikibaseintegrator.wbi_enums import ActionIfExists, WikibaseDatePrecision
 
 import config
+from models.http_pool import HttpPool
+from models.profiler import Profiler
 from models.title import Title
+from models.title_corpus import TitleDiff
 import re
 
 
@@ -138,21 +138,44 @@ class LawItem(BaseModel):
     disabled_languages: Set[str] = set()
     euid_pattern: Pattern = re.compile(r"(\(EU\) \d{4}/\d{1,5})")
     euid: str = ""
+    # number of distinct EU languages already present on Wikidata
+    wikidata_title_count: int = 0
+    wikidata_label_count: int = 0
+    disabled_languages_fetched: bool = False
+    profiler: Profiler = Profiler()
+    http_pool: HttpPool = Field(default_factory=HttpPool)
+    # dateModified on Wikidata, only fetched in watch mode
+    modified: str = ""
+    # languages Eur-Lex has the act in, if known from an earlier run
+    available_language_count: int = len(EU_LANGUAGES)
 
     class Config:
         arbitrary_types_allowed = True
 
-    def get_disabled_languages(self) -> None:
-        # get EN page
-        url = (
-            f"https://eur-lex.europa.eu/legal-content/EN"
+    @property
+    def expected_yield(self) -> int:
+        """Upper bound of titles and labels that Eur-Lex can add to the item.
+        All EU languages are counted as available unless the scraper
+        knows the languages of the act from an earlier run"""
+        missing_titles = self.available_language_count - self.wikidata_title_count
+        missing_labels = self.available_language_count - self.wikidata_label_count
+        return max(0, missing_titles) + max(0, missing_labels)
+
+    def eurlex_url(self, language: str) -> str:
+        return (
+            f"https://eur-lex.europa.eu/legal-content/{language}"
             f"/TXT/?uri=CELEX:{self.celex_id}"
         )
-        response = requests.get(url)
 
-        # Use SoupStrainer to parse only the 'li' elements in the dropdown menu
-        strainer = SoupStrainer("li")
-        soup = BeautifulSoup(response.content, "lxml", parse_only=strainer)
+    def get_disabled_languages(self) -> None:
+        self.http_pool.run(self.fetch_disabled_languages())
+
+    async def fetch_disabled_languages(self) -> None:
+        # get EN page, the download is shared with fetch_title
+        url = self.eurlex_url(language="en")
+        soup = await self.http_pool.fetch_soup(url=url)
+        if soup is None:
+            return
 
         # Find all 'li' elements in the dropdown menu
         dropdown_items = soup.find_all("li", class_="disabled")
@@ -164,14 +187,33 @@ class LawItem(BaseModel):
                 lang_code = span.text.lower().strip()
                 if lang_code in EU_LANGUAGES:
                     self.disabled_languages.add(lang_code)
+        self.disabled_languages_fetched = True
 
     def start(self):
-        self.get_disabled_languages()
-        asyncio.run(self.scrape_law_titles())
-        self.enrich_wikidata()
+        self.scrape()
+        self.enrich()
+
+    def scrape(self):
+        """Fetch the disabled languages and the titles from Eur-Lex"""
+        if not self.disabled_languages_fetched:
+            with self.profiler.stage("get_disabled_languages"):
+                self.get_disabled_languages()
+        with self.profiler.stage("scrape_law_titles"):
+            self.http_pool.run(self.scrape_law_titles())
+
+    def enrich(self):
+        with self.profiler.stage("enrich_wikidata"):
+            self.enrich_wikidata()
+
+    def copy_scraped_data(self, law_item: "LawItem"):
+        """Reuse what was scraped for another item with the same CELEX id"""
+        self.disabled_languages = set(law_item.disabled_languages)
+        self.disabled_languages_fetched = law_item.disabled_languages_fetched
+        self.accepted_titles = list(law_item.accepted_titles)
 
     def enrich_wikidata(self):
-        self.item = self.wbi.item.get(entity_id=self.item_id)
+        with self.profiler.allocations_in("wikibaseintegrator_json"):
+            self.item = self.wbi.item.get(entity_id=self.item_id)
         print(self.item.get_entity_url())
         self.add_labels_and_aliases()
         self.extract_and_add_euid()
@@ -182,13 +224,55 @@ class LawItem(BaseModel):
             if config.press_enter_to_continue:
                 input("press enter to upload")
             logger.info("Uploading now")
-            self.item.write(
-                summary=f"Adding titles, labels and aliases with [[Wikidata:Tools/WikidataEurLexScraper|WikidataEurLexScraper]] ([[:toolforge:editgroups/b/CB/{self.edit_groups_hash}|details]]) see [[Wikidata:Requests_for_permissions/Bot/So9qBot_8|bot_task]]"
-            )
+            with self.profiler.allocations_in("wikibaseintegrator_json"):
+                self.item.write(
+                    summary=f"Adding titles, labels and aliases with [[Wikidata:Tools/WikidataEurLexScraper|WikidataEurLexScraper]] ([[:toolforge:editgroups/b/CB/{self.edit_groups_hash}|details]]) see [[Wikidata:Requests_for_permissions/Bot/So9qBot_8|bot_task]]"
+                )
             print(self.item.get_entity_url())
             if config.press_enter_to_continue:
                 input("press enter to continue")
 
+    def apply_name_diffs(self, diffs: List[TitleDiff]):
+        """Replace the labels and aliases that equal a name derived by the
+        old regexes with the name derived by the current ones. The title
+        statements are left alone because the titles did not change."""
+        with self.profiler.allocations_in("wikibaseintegrator_json"):
+            self.item = self.wbi.item.get(entity_id=self.item_id)
+        print(self.item.get_entity_url())
+        for diff in diffs:
+            self.apply_name_diff(diff=diff)
+        if self.something_to_upload:
+            logger.info("Uploading now")
+            with self.profiler.allocations_in("wikibaseintegrator_json"):
+                self.item.write(
+                    summary=f"Updating labels and aliases derived from titles with [[Wikidata:Tools/WikidataEurLexScraper|WikidataEurLexScraper]] ([[:toolforge:editgroups/b/CB/{self.edit_groups_hash}|details]]) see [[Wikidata:Requests_for_permissions/Bot/So9qBot_8|bot_task]]"
+                )
+
+    def apply_name_diff(self, diff: TitleDiff):
+        label = self.item.labels.get(language=diff.language)
+        if diff.old and diff.new and label == diff.old:
+            logger.info(f"replacing label '{diff.old}' with '{diff.new}'")
+            self.item.labels.set(language=diff.language, value=diff.new)
+            self.something_to_upload = True
+        aliases = [
+            alias
+            for alias in self.item.aliases.get(language=diff.language) or []
+            if not alias.removed
+        ]
+        for alias in aliases:
+            if diff.old and alias == diff.old:
+                logger.info(f"removing alias '{diff.old}'")
+                alias.remove()
+                self.something_to_upload = True
+        if (
+            diff.new
+            and self.item.labels.get(language=diff.language) != diff.new
+            and diff.new not in aliases
+        ):
+            logger.info(f"adding alias '{diff.new}'")
+            self.item.aliases.set(language=diff.language, values=[diff.new])
+            self.something_to_upload = True
+
     def title_claims(self) -> List[Claim]:
         return self.item.claims.get(property=config.title_property_id)
 
@@ -247,7 +331,8 @@ class LawItem(BaseModel):
 
     def extract_eecid_from_title_and_add_to_alias(self):
         for title in self.accepted_titles:
-            eecid = title.extract_eecid
+            with self.profiler.allocations_in("title_regex"):
+                eecid = title.extract_eecid
             if eecid:
                 self.something_to_upload = True
                 self.item.aliases.set(language=title.language, values=[eecid])
@@ -294,10 +379,13 @@ class LawItem(BaseModel):
                     else:
                         title_that_can_be_added = title
             if title_that_can_be_added is not None:
+                with self.profiler.allocations_in("title_regex"):
+                    shortname_with_institution = title_that_can_be_added.shortname_with_institution
+                    shortname_without_institution = title_that_can_be_added.shortname_without_institution
                 label = self.item.labels.get(language=language)
                 if label:
                     has_label = True
-                    if label == title_that_can_be_added.shortname_without_institution:
+                    if label == shortname_without_institution:
                         logger.info(
                             f"label for {language} in "
                             "wikidata mathches the shortname, skipping this language"
@@ -310,9 +398,9 @@ class LawItem(BaseModel):
                         for alias in aliases:
                             if alias == title_that_can_be_added.value:
                                 full_title_already_in_alias = True
-                            if alias == title_that_can_be_added.shortname_with_institution:
+                            if alias == shortname_with_institution:
                                 shortname_with_institution_already_in_alias = True
-                            if alias == title_that_can_be_added.shortname_without_institution:
+                            if alias == shortname_without_institution:
                                 shortname_without_institution_already_in_alias = True
                 if not full_title_already_in_alias or not shortname_without_institution_already_in_wikidata_label or not shortname_with_institution_already_in_alias:  # and title_for_this_language.title
                     self.something_to_upload = True
@@ -320,18 +408,18 @@ class LawItem(BaseModel):
                     if not has_label:
                         # add as label
                         self.item.labels.set(
-                            value=title_that_can_be_added.shortname_without_institution, language=language
+                            value=shortname_without_institution, language=language
                         )
                     if not shortname_with_institution_already_in_alias:
                         # add as alias
                         self.item.aliases.set(
-                            values=[title_that_can_be_added.shortname_with_institution],
+                            values=[shortname_with_institution],
                             language=language,
                         )
                     if has_label and not shortname_without_institution_already_in_alias:
                         # add as alias and let the contributors shuffle them around later if they want
                         self.item.aliases.set(
-                            values=[title_that_can_be_added.shortname_without_institution],
+                            values=[shortname_without_institution],
                             language=language,
                         )
                 else:
@@ -361,38 +449,26 @@ class LawItem(BaseModel):
         print(f"Fetching law titles for {self.celex_id}")
         available_languages = set(EU_LANGUAGES) - self.disabled_languages
 
-        async with aiohttp.ClientSession() as session:
-            tasks = []
-            for language in available_languages:
-                # Construct the URL based on the CELEX identifier
-                url = (
-                    f"https://eur-lex.europa.eu/legal-content/{language}"
-                    f"/TXT/?uri=CELEX:{self.celex_id}"
+        tasks = []
+        for language in available_languages:
+            # Construct the URL based on the CELEX identifier
+            url = self.eurlex_url(language=language)
+            tasks.append(self.fetch_title(url, language))
+
+        # Wait for all the tasks to complete
+        await asyncio.gather(*tasks)
+
+    async def fetch_title(self, url, language):
+        soup = await self.http_pool.fetch_soup(url=url)
+        if soup is not None:
+            # Find the element containing the law title using the provided jQuery selector
+            law_title = soup.select_one("p#title").get_text(strip=True)
+
+            # Guard against None
+            if law_title:
+                title = Title(
+                    value=law_title, language=language, celex_id=self.celex_id
                 )
-                logger.info(f"Fetching {url}")
-                tasks.append(self.fetch_title(session, url, language))
-
-            # Wait for all the tasks to complete
-            await asyncio.gather(*tasks)
-
-    async def fetch_title(self, session, url, language):
-        # Send a GET request to the URL
-        async with session.get(url) as response:
-            if response.status == 200:
-                # Parse the HTML content using BeautifulSoup
-                content = await response.text()
-                soup = BeautifulSoup(content, "lxml")
-
-                # Find the element containing the law title using the provided jQuery selector
-                law_title = soup.select_one("p#title").get_text(strip=True)
-
-                # Guard against None
-                if law_title:
-                    title = Title(
-                        value=law_title, language=language, celex_id=self.celex_id
-                    )
-                    self.accepted_titles.append(title)
-                else:
-                    raise ValueError(f"No law title found, see {url}")
+                self.accepted_titles.append(title)
             else:
-                logger.info(f"Got {response.status} from eur-lex")
+                raise ValueError(f"No law title found, see {url}")
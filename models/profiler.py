@@ -0,0 +1,200 @@
+import cProfile
+import logging
+import os
+import pstats
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, Dict, List
+
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+
+class StageStats(BaseModel):
+    """Accumulated measurements of one stage across all law items"""
+
+    calls: int = 0
+    cpu_time: float = 0.0
+    wall_time: float = 0.0
+    stats: Any = None  # pstats.Stats
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    @property
+    def wait_time(self) -> float:
+        """Time not spent on the CPU, which is mostly asyncio tasks
+        waiting for responses from Eur-Lex and Wikidata"""
+        return max(0.0, self.wall_time - self.cpu_time)
+
+
+class Profiler(BaseModel):
+    """Profiles the stages of LawItem.start and the allocations of
+    selected sections. It does nothing unless enabled in the config.
+
+    The CPU profiles are written as pstats files and as collapsed stacks
+    that can be turned into flamegraphs with flamegraph.pl or speedscope.
+    Note that tracing allocations slows down the stages that contain
+    allocation sections."""
+
+    enabled: bool = False
+    output_dir: str = "profiles"
+    top_n: int = 10
+    max_stack_depth: int = 64
+    stages: Dict[str, StageStats] = {}
+    # section -> source line -> [size in bytes, count]
+    allocations: Dict[str, Dict[str, List[int]]] = {}
+    # section -> highest peak in bytes above the memory in use at the start
+    peaks: Dict[str, int] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        """Record the CPU profile, CPU time and wait time of a stage.
+        Stages must not be nested because only one cProfile can be active"""
+        if not self.enabled:
+            yield
+            return
+        profile = cProfile.Profile()
+        cpu_start = time.process_time()
+        wall_start = time.perf_counter()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            stage = self.stages.setdefault(name, StageStats())
+            stage.calls += 1
+            stage.cpu_time += time.process_time() - cpu_start
+            stage.wall_time += time.perf_counter() - wall_start
+            if stage.stats is None:
+                stage.stats = pstats.Stats(profile)
+            else:
+                stage.stats.add(profile)
+
+    @contextmanager
+    def allocations_in(self, section: str):
+        """Record the memory still allocated after a section by source line
+        and the peak, which also covers temporary allocations"""
+        if not self.enabled:
+            yield
+            return
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        start, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        try:
+            yield
+        finally:
+            _, peak = tracemalloc.get_traced_memory()
+            self.peaks[section] = max(self.peaks.get(section, 0), peak - start)
+            after = tracemalloc.take_snapshot()
+            ignore_tracemalloc = (tracemalloc.Filter(False, tracemalloc.__file__),)
+            lines = self.allocations.setdefault(section, {})
+            for statistic in after.filter_traces(ignore_tracemalloc).compare_to(
+                before.filter_traces(ignore_tracemalloc), "lineno"
+            ):
+                if statistic.size_diff > 0:
+                    key = str(statistic.traceback)
+                    size, count = lines.get(key, [0, 0])
+                    lines[key] = [
+                        size + statistic.size_diff,
+                        count + statistic.count_diff,
+                    ]
+
+    def write_reports(self):
+        if not self.enabled:
+            return
+        os.makedirs(self.output_dir, exist_ok=True)
+        summary = []
+        for name, stage in self.stages.items():
+            stage.stats.dump_stats(os.path.join(self.output_dir, f"{name}.prof"))
+            with open(
+                os.path.join(self.output_dir, f"{name}.collapsed"), "w"
+            ) as file:
+                for stack, microseconds in self.collapsed_stacks(
+                    stats=stage.stats
+                ).items():
+                    file.write(f"{stack} {microseconds}\n")
+            summary.append(
+                f"{name}: {stage.calls} calls, cpu {stage.cpu_time:.2f}s, "
+                f"wait {stage.wait_time:.2f}s, wall {stage.wall_time:.2f}s"
+            )
+        for section, lines in self.allocations.items():
+            summary.append(
+                f"Top {self.top_n} allocations in {section}, "
+                f"peak {self.peaks.get(section, 0) / 1024:.1f} KiB:"
+            )
+            top_lines = sorted(
+                lines.items(), key=lambda line: line[1][0], reverse=True
+            )[: self.top_n]
+            for line, (size, count) in top_lines:
+                summary.append(f"  {line}: {size / 1024:.1f} KiB in {count} blocks")
+        with open(os.path.join(self.output_dir, "summary.txt"), "w") as file:
+            file.write("\n".join(summary) + "\n")
+        print("\n".join(summary))
+        print(f"Profiles written to {self.output_dir}")
+
+    def collapsed_stacks(self, stats: pstats.Stats) -> Dict[str, int]:
+        """Convert the caller graph of pstats to collapsed stacks.
+        pstats does not keep full stacks so the time of a function
+        is split between its callers in proportion to the time spent
+        in each caller. Recursive calls are cut off."""
+        children = defaultdict(list)
+        for function, (_, _, _, _, callers) in stats.stats.items():
+            for caller, (_, _, _, cumulative_time) in callers.items():
+                children[caller].append((function, cumulative_time))
+        stacks: Dict[str, int] = defaultdict(int)
+        for function, (_, _, _, cumulative_time, callers) in stats.stats.items():
+            if not callers:
+                self.collapse(
+                    stats=stats,
+                    children=children,
+                    function=function,
+                    stack=[],
+                    cumulative_time=cumulative_time,
+                    stacks=stacks,
+                )
+        return dict(stacks)
+
+    def collapse(
+        self,
+        stats: pstats.Stats,
+        children: Dict[tuple, list],
+        function: tuple,
+        stack: List[str],
+        cumulative_time: float,
+        stacks: Dict[str, int],
+    ):
+        _, _, total_time, function_cumulative_time, _ = stats.stats[function]
+        # prune paths below a microsecond to keep the walk small
+        if not function_cumulative_time or cumulative_time < 1e-6:
+            return
+        ratio = cumulative_time / function_cumulative_time
+        stack = stack + [self.frame_name(function)]
+        microseconds = int(total_time * ratio * 1_000_000)
+        if microseconds > 0:
+            stacks[";".join(stack)] += microseconds
+        if len(stack) >= self.max_stack_depth:
+            return
+        for child, child_cumulative_time in children[function]:
+            if self.frame_name(child) not in stack:
+                self.collapse(
+                    stats=stats,
+                    children=children,
+                    function=child,
+                    stack=stack,
+                    cumulative_time=child_cumulative_time * ratio,
+                    stacks=stacks,
+                )
+
+    @staticmethod
+    def frame_name(function: tuple) -> str:
+        filename, line, name = function
+        if filename == "~":
+            # built-in functions have no file
+            return name
+        return f"{name} ({os.path.basename(filename)}:{line})"
@@ -1,9 +1,10 @@
 import logging
 import re
+from datetime import date
 from re import Pattern
 from typing import Dict, Set
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 logger = logging.getLogger(__name__)
 
@@ -12,6 +13,7 @@ class Title(BaseModel):
     value: str
     language: str
     celex_id: str
+    retrieved: date = Field(default_factory=date.today)
     eecid_pattern: Pattern = re.compile(r"(\d{2}\/\d{1,4}\/[A-ZØ]{3,4})")
     # This dict was written by Samoasambia, see https://github.com/Samoasambia/wikidata/blob/main/EU%20legal%20act%20short%20title.ipynb
     regex_list: Dict[str,str] = {
@@ -0,0 +1,168 @@
+import logging
+import sqlite3
+from typing import Any, Dict, List
+
+from pydantic import BaseModel
+
+from models.title import Title
+
+logger = logging.getLogger(__name__)
+
+# Column -> property of Title that derives it with a regex
+DERIVED_FIELDS = dict(
+    shortname_with_institution="shortname_with_institution",
+    shortname_without_institution="shortname_without_institution",
+    eecid="extract_eecid",
+)
+
+
+class TitleDiff(BaseModel):
+    """A derived name that changed since the title was stored"""
+
+    celex_id: str
+    item_ids: List[str]
+    language: str
+    field: str
+    old: str | None
+    new: str | None
+
+
+class TitleCorpus(BaseModel):
+    """Stores every accepted title together with the names derived from it.
+    This makes it possible to derive the names again after the regexes
+    in Title have changed without fetching anything from Eur-Lex."""
+
+    path: str = "database.db"
+    conn: Any = None
+    cursor: Any = None
+
+    def connect(self):
+        self.conn = sqlite3.connect(self.path)
+        self.cursor = self.conn.cursor()
+        self.cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS titles (
+                celex_id TEXT,
+                language TEXT,
+                value TEXT,
+                eurlex_url TEXT,
+                retrieved TEXT,
+                shortname_with_institution TEXT,
+                shortname_without_institution TEXT,
+                eecid TEXT,
+                PRIMARY KEY (celex_id, language)
+            )
+        """
+        )
+        self.cursor.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_titles_language ON titles (language)
+        """
+        )
+        # The Wikidata items that the titles of an act were added to
+        self.cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS title_items (
+                celex_id TEXT,
+                item_id TEXT,
+                PRIMARY KEY (celex_id, item_id)
+            )
+        """
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    @staticmethod
+    def derive(title: Title) -> Dict[str, str | None]:
+        return {
+            field: getattr(title, property_name)
+            for field, property_name in DERIVED_FIELDS.items()
+        }
+
+    def add_titles(self, titles: List[Title]):
+        self.cursor.executemany(
+            """
+            INSERT OR REPLACE INTO titles (
+                celex_id, language, value, eurlex_url, retrieved,
+                shortname_with_institution, shortname_without_institution,
+                eecid
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+            [
+                (
+                    title.celex_id,
+                    title.language,
+                    title.value,
+                    title.eurlex_url,
+                    title.retrieved.isoformat(),
+                    *self.derive(title=title).values(),
+                )
+                for title in titles
+            ],
+        )
+        self.conn.commit()
+
+    def add_item_ids(self, celex_id: str, item_ids: List[str]):
+        self.cursor.executemany(
+            "INSERT OR IGNORE INTO title_items (celex_id, item_id) VALUES (?, ?)",
+            [(celex_id, item_id) for item_id in item_ids],
+        )
+        self.conn.commit()
+
+    def get_item_ids(self) -> Dict[str, List[str]]:
+        self.cursor.execute("SELECT celex_id, item_id FROM title_items")
+        item_ids: Dict[str, List[str]] = {}
+        for celex_id, item_id in self.cursor.fetchall():
+            item_ids.setdefault(celex_id, []).append(item_id)
+        return item_ids
+
+    def get_language_counts(self) -> Dict[str, int]:
+        """Return the number of stored titles of every act"""
+        self.cursor.execute("SELECT celex_id, COUNT(*) FROM titles GROUP BY celex_id")
+        return dict(self.cursor.fetchall())
+
+    def rederive(self, language: str = "") -> List[TitleDiff]:
+        """Derive the names again from the stored titles and
+        return only the names that differ from the stored ones"""
+        query = f"SELECT celex_id, language, value, {', '.join(DERIVED_FIELDS)} FROM titles"
+        if language:
+            self.cursor.execute(query + " WHERE language = ?", (language,))
+        else:
+            self.cursor.execute(query)
+        rows = self.cursor.fetchall()
+        item_ids = self.get_item_ids()
+        diffs = []
+        for celex_id, language, value, *stored in rows:
+            title = Title(celex_id=celex_id, language=language, value=value)
+            derived = self.derive(title=title)
+            for field, old in zip(DERIVED_FIELDS, stored):
+                if derived[field] != old:
+                    diffs.append(
+                        TitleDiff(
+                            celex_id=celex_id,
+                            item_ids=item_ids.get(celex_id, []),
+                            language=language,
+                            field=field,
+                            old=old,
+                            new=derived[field],
+                        )
+                    )
+        logger.info(f"found {len(diffs)} changed names")
+        return diffs
+
+    def save_diffs(self, diffs: List[TitleDiff]):
+        """Store the new names as applied so the next rederive only
+        shows new changes. Only call this after the diffs were applied
+        to Wikidata."""
+        for field in DERIVED_FIELDS:
+            self.cursor.executemany(
+                f"UPDATE titles SET {field} = ? WHERE celex_id = ? AND language = ?",
+                [
+                    (diff.new, diff.celex_id, diff.language)
+                    for diff in diffs
+                    if diff.field == field
+                ],
+            )
+        self.conn.commit()
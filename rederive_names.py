@@ -0,0 +1,70 @@
+"""Derive the shortname labels, aliases and EECIDs again from the titles
+stored by scrape_names.py and print the names that changed as JSON lines.
+Run this after changing the regexes in Title.
+Use --apply to replace the old names with the new ones on the Wikidata
+items of each act.
+The changes of an act are only marked as applied after all its items
+were written, so failed acts are shown again by the next run."""
+import argparse
+import logging
+import random
+from typing import Dict, List
+
+from wikibaseintegrator import WikibaseIntegrator
+from wikibaseintegrator.wbi_config import config as wbconfig
+from wikibaseintegrator.wbi_login import Login
+
+import config
+from models.law_item import LawItem
+from models.title_corpus import TitleCorpus, TitleDiff
+
+logging.basicConfig(level=config.loglevel)
+logger = logging.getLogger(__name__)
+wbconfig["USER_AGENT"] = config.user_agent
+
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument("--language", default="", help="only this language, e.g. el")
+parser.add_argument(
+    "--apply", action="store_true", help="add the new names to Wikidata"
+)
+args = parser.parse_args()
+
+
+def apply_diffs(corpus: TitleCorpus, diffs: List[TitleDiff]):
+    """Replace the changed names on the items of every act. Labels and
+    aliases that do not equal the old name are kept."""
+    wbi = WikibaseIntegrator(
+        login=Login(user=config.user_name, password=config.bot_password)
+    )
+    edit_groups_hash = "{:x}".format(random.randrange(0, 2**48))
+    diffs_by_celex: Dict[str, List[TitleDiff]] = {}
+    for diff in diffs:
+        diffs_by_celex.setdefault(diff.celex_id, []).append(diff)
+    for celex_id, celex_diffs in diffs_by_celex.items():
+        item_ids = celex_diffs[0].item_ids
+        if not item_ids:
+            logger.warning(f"no items are known for {celex_id}, skipping")
+            continue
+        try:
+            for item_id in item_ids:
+                LawItem(
+                    item_id=item_id,
+                    celex_id=celex_id,
+                    wbi=wbi,
+                    edit_groups_hash=edit_groups_hash,
+                ).apply_name_diffs(diffs=celex_diffs)
+        except Exception as error:
+            logger.error(f"Failed to apply the changes of {celex_id}: {error!r}")
+            continue
+        corpus.save_diffs(diffs=celex_diffs)
+        logger.info(f"applied {len(celex_diffs)} changed names of {celex_id}")
+
+
+corpus = TitleCorpus()
+corpus.connect()
+diffs = corpus.rederive(language=args.language)
+for diff in diffs:
+    print(diff.model_dump_json())
+if args.apply:
+    apply_diffs(corpus=corpus, diffs=diffs)
+corpus.close()
@@ -8,3 +8,11 @@ user_agent = f"wikidataeurlexscraper, see https://github.com/dpriskorn/WikidataE
 loglevel = logging.INFO
 press_enter_to_continue = True
 title_property_id = "P1476"
+# write CPU and allocation profiles of each stage to profile_dir
+profile = False
+profile_dir = "profiles"
+# keep running and process new items and newly published languages
+watch = False
+watch_poll_interval = 300  # seconds
+watch_max_backlog = 50  # items processed per poll
+watch_language_window_days = 30  # how long to look for new languages
@@ -6,80 +6,386 @@ It currently only scrapes the name of the law"""
 import logging
 import random
 import sqlite3
-from typing import List, Any
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Any
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from wikibaseintegrator import WikibaseIntegrator
 from wikibaseintegrator.wbi_config import config as wbconfig
 from wikibaseintegrator.wbi_helpers import execute_sparql_query
 from wikibaseintegrator.wbi_login import Login
 
 import config
-from models.law_item import LawItem
+from models.http_pool import HttpPool
+from models.law_item import LawItem, EU_LANGUAGES, Euid_not_found
+from models.profiler import Profiler
+from models.title_corpus import TitleCorpus
 
 logging.basicConfig(level=config.loglevel)
 logger = logging.getLogger(__name__)
 wbconfig["USER_AGENT"] = config.user_agent
 
 
+# Used to restrict the counts to the languages we can scrape
+eu_language_filter = ", ".join(f'"{language}"' for language in EU_LANGUAGES)
+# Used to count titles and labels for only the items in a poll
+values_chunk_size = 200
+
+
+def get_count_subqueries(item_values: str = "") -> str:
+    """This counts the EU languages with a title and a label per item
+    so we can work on the items with the highest expected yield first.
+    The subqueries are evaluated on their own, so item_values has to be
+    repeated inside them to restrict the counting to those items."""
+    return f"""
+      OPTIONAL {{
+        SELECT ?item (COUNT(DISTINCT ?title_lang) AS ?titles)
+        WHERE {{
+          {item_values}
+          ?item wdt:P476 [];
+                wdt:{config.title_property_id} ?title.
+          BIND(LANG(?title) AS ?title_lang)
+          FILTER(?title_lang IN ({eu_language_filter}))
+        }}
+        GROUP BY ?item
+      }}
+      OPTIONAL {{
+        SELECT ?item (COUNT(DISTINCT ?label_lang) AS ?labels)
+        WHERE {{
+          {item_values}
+          ?item wdt:P476 [];
+                rdfs:label ?label.
+          BIND(LANG(?label) AS ?label_lang)
+          FILTER(?label_lang IN ({eu_language_filter}))
+        }}
+        GROUP BY ?item
+      }}"""
+
+
 class EurlexScraper(BaseModel):
     conn: Any = None
     cursor: Any = None
-    sparql_query: str = """
-    SELECT ?item ?celex_id
-    WHERE {
+    sparql_query: str = f"""
+    SELECT ?item ?celex_id ?titles ?labels
+    WHERE {{
       ?item wdt:P476 ?celex_id.
-    }
+      {get_count_subqueries()}
+    }}
     """
     items: List[LawItem] = []
     wbi: WikibaseIntegrator
     max: int = 0
     edit_groups_hash: str = "{:x}".format(random.randrange(0, 2**48))
+    profiler: Profiler = Profiler(
+        enabled=config.profile, output_dir=config.profile_dir
+    )
+    http_pool: HttpPool = Field(default_factory=HttpPool)
+    title_corpus: TitleCorpus = Field(default_factory=TitleCorpus)
+    # watch mode
+    poll_interval: int = config.watch_poll_interval
+    max_backlog: int = config.watch_max_backlog
+    language_window_days: int = config.watch_language_window_days
 
     class Config:
         arbitrary_types_allowed = True
 
+    def model_post_init(self, __context):
+        self.http_pool.profiler = self.profiler
+
     def start(self):
-        self.fetch_items()
         self.connect()
         self.get_cursor()
         self.create_db()
+        self.title_corpus.connect()
+        try:
+            self.fetch_items()
+            self.get_count_of_done_item_ids()
+            self.iterate_items()
+        finally:
+            self.conn.close()
+            self.title_corpus.close()
+            self.http_pool.close()
+            self.profiler.write_reports()
+
+    def watch(self):
+        """Poll for new items and newly published languages until interrupted.
+        The HTTP pools and the database connection are kept open between polls."""
+        self.connect()
+        self.get_cursor()
+        self.create_db()
+        self.title_corpus.connect()
         self.get_count_of_done_item_ids()
-        self.iterate_items()
-        self.conn.close()
+        try:
+            while True:
+                try:
+                    self.poll()
+                except Exception as error:
+                    # e.g. a timeout from the query service, try again next poll
+                    logger.error(f"Poll failed: {error!r}")
+                print(f"Waiting {self.poll_interval} seconds until the next poll")
+                time.sleep(self.poll_interval)
+        finally:
+            self.conn.close()
+            self.title_corpus.close()
+            self.http_pool.close()
+            self.profiler.write_reports()
+
+    def poll(self):
+        watermark = self.get_watermark()
+        print(f"Polling for items modified since {watermark}")
+        self.items = []
+        self.fetch_items(sparql_query=self.incremental_sparql_query(since=watermark))
+        self.fetch_counts()
+        backlog = self.unprocessed(items=self.prioritize_items())
+        # failed items are recorded so the watermark can move past them,
+        # they are only tried again when they change on Wikidata
+        deferred = backlog[self.max_backlog :]
+        count = 0
+        for items in self.group_by_celex(items=backlog[: self.max_backlog]).values():
+            items = self.unprocessed(items=items)
+            if items:
+                print(
+                    f"Processing new or changed items {count+1}-{count+len(items)} "
+                    f"of {len(backlog)} with CELEX id {items[0].celex_id}"
+                )
+                self.try_process_items(items=items)
+                count += len(items)
+        if deferred:
+            print(f"Backlog is full, deferring {len(deferred)} items to the next poll")
+            # deferred items are picked up again by the next query
+            self.set_watermark(value=min(item.modified for item in deferred))
+        elif self.items:
+            self.set_watermark(value=max(item.modified for item in self.items))
+        self.recheck_disabled_languages()
+
+    def recheck_disabled_languages(self):
+        """Process items again when Eur-Lex has published
+        languages that were disabled when we processed them"""
+        window_start = self.now(delta=timedelta(days=-self.language_window_days))
+        self.cursor.execute(
+            "DELETE FROM pending_languages WHERE first_seen < ?", (window_start,)
+        )
+        self.conn.commit()
+        self.cursor.execute(
+            """
+            SELECT item_id, celex_id, disabled FROM pending_languages
+            ORDER BY checked LIMIT ?
+        """,
+            (self.max_backlog,),
+        )
+        for item_id, celex_id, disabled in self.cursor.fetchall():
+            item = self.get_law_item(item_id=f"Q{item_id}", celex_id=celex_id)
+            try:
+                item.get_disabled_languages()
+            except Exception as error:
+                logger.error(f"Could not check languages of {celex_id}: {error!r}")
+            if not item.disabled_languages_fetched:
+                # Eur-Lex did not answer, keep the row and try again later
+                published = set()
+            else:
+                published = set(disabled.split(",")) - item.disabled_languages
+            if published:
+                print(
+                    f"Eur-Lex has published {', '.join(sorted(published))} "
+                    f"for {celex_id}, processing Q{item_id} again"
+                )
+                # scrape() reuses the disabled languages fetched above
+                self.try_process_items(items=[item])
+            else:
+                self.http_pool.clear_cache()
+            # move the item to the end of the queue, also when it failed
+            self.cursor.execute(
+                "UPDATE pending_languages SET checked = ? WHERE item_id = ?",
+                (self.now(), item_id),
+            )
+            self.conn.commit()
+
+    def process_items(self, items: List[LawItem]):
+        """Scrape the act once and enrich every item linked to it"""
+        first_item = items[0]
+        try:
+            first_item.scrape()
+        finally:
+            # the parsed pages of this act are not needed anymore
+            self.http_pool.clear_cache()
+        # keep the titles so names can be derived again offline
+        self.title_corpus.add_titles(titles=first_item.accepted_titles)
+        self.title_corpus.add_item_ids(
+            celex_id=first_item.celex_id, item_ids=[item.item_id for item in items]
+        )
+        for item in items:
+            if item is not first_item:
+                item.copy_scraped_data(law_item=first_item)
+            item.enrich()
+            item_id = int(item.item_id[1:])
+            if not self.already_processed(item_id=item_id):
+                self.add_item_id_to_database(item_id=item_id)
+            self.set_item_state(item=item)
+            self.update_pending_languages(item=item)
+
+    def try_process_items(self, items: List[LawItem]):
+        """Process the items and record the ones that fail
+        so a single broken act does not stop watch mode"""
+        started = self.now()
+        try:
+            self.process_items(items=items)
+        except (Exception, Euid_not_found) as error:
+            # Euid_not_found is raised for e.g. CFSP and Euratom acts
+            logger.error(
+                f"Failed to process {items[0].celex_id} "
+                f"for {', '.join(item.item_id for item in items)}: {error!r}"
+            )
+            for item in items:
+                state = self.get_item_state(item=item)
+                if state is None or state[0] < started:
+                    self.set_item_state(item=item, error=repr(error))
+
+    def unprocessed(self, items: List[LawItem]) -> List[LawItem]:
+        return [item for item in items if self.needs_processing(item=item)]
 
-    def fetch_items(self):
-        query = execute_sparql_query(self.sparql_query)
+    def needs_processing(self, item: LawItem) -> bool:
+        """New items and items that changed on Wikidata since we
+        processed them or since they failed need processing"""
+        state = self.get_item_state(item=item)
+        if state is None:
+            # processed before item_state was recorded or never seen
+            return not self.already_processed(item_id=int(item.item_id[1:]))
+        processed_at, _ = state
+        # our own edit is older than processed_at so it does not count
+        return item.modified > processed_at
+
+    @staticmethod
+    def group_by_celex(items: List[LawItem]) -> Dict[str, List[LawItem]]:
+        """Group the items so each act is only scraped once.
+        The groups keep the order of their first item."""
+        groups: Dict[str, List[LawItem]] = {}
+        for item in items:
+            groups.setdefault(item.celex_id, []).append(item)
+        return groups
+
+    @staticmethod
+    def incremental_sparql_query(since: str) -> str:
+        return f"""
+    SELECT ?item ?celex_id ?modified
+    WHERE {{
+      ?item wdt:P476 ?celex_id;
+            schema:dateModified ?modified.
+      FILTER(?modified >= "{since}"^^xsd:dateTime)
+    }}
+    """
+
+    @staticmethod
+    def count_sparql_query(item_ids: List[str]) -> str:
+        item_values = f"VALUES ?item {{ {' '.join(f'wd:{item_id}' for item_id in item_ids)} }}"
+        return f"""
+    SELECT ?item ?titles ?labels
+    WHERE {{
+      {item_values}
+      {get_count_subqueries(item_values=item_values)}
+    }}
+    """
+
+    def fetch_counts(self):
+        """Count the titles and labels of only the fetched items"""
+        item_ids = sorted({item.item_id for item in self.items})
+        counts = {}
+        for index in range(0, len(item_ids), values_chunk_size):
+            query = execute_sparql_query(
+                self.count_sparql_query(
+                    item_ids=item_ids[index : index + values_chunk_size]
+                )
+            )
+            for result in query["results"]["bindings"]:
+                item_id = self.get_stripped_qid(item_id=str(result["item"]["value"]))
+                counts[item_id] = (
+                    self.get_count(result=result, key="titles"),
+                    self.get_count(result=result, key="labels"),
+                )
+        for item in self.items:
+            if item.item_id in counts:
+                item.wikidata_title_count, item.wikidata_label_count = counts[
+                    item.item_id
+                ]
+
+    def get_law_item(self, item_id: str, celex_id: str) -> LawItem:
+        return LawItem(
+            item_id=item_id,
+            celex_id=celex_id,
+            wbi=self.wbi,
+            edit_groups_hash=self.edit_groups_hash,
+            profiler=self.profiler,
+            http_pool=self.http_pool,
+        )
+
+    def fetch_items(self, sparql_query: str = ""):
+        query = execute_sparql_query(sparql_query or self.sparql_query)
 
         # Fetching items from the query result
         for result in query["results"]["bindings"]:
             item_id = self.get_stripped_qid(item_id=str(result["item"]["value"]))
             celex_id = result["celex_id"]["value"]
-            self.items.append(
-                LawItem(
-                    item_id=item_id,
-                    celex_id=celex_id,
-                    wbi=self.wbi,
-                    edit_groups_hash=self.edit_groups_hash,
-                )
-            )
+            item = self.get_law_item(item_id=item_id, celex_id=celex_id)
+            item.wikidata_title_count = self.get_count(result=result, key="titles")
+            item.wikidata_label_count = self.get_count(result=result, key="labels")
+            if "modified" in result:
+                item.modified = result["modified"]["value"]
+            self.items.append(item)
+
+    def prioritize_items(self) -> List[LawItem]:
+        """Sort the items by expected yield and drop the items
+        that already have a title and label in every available language"""
+        self.set_available_language_counts()
+        prioritized_items = []
+        for item in self.items:
+            if item.expected_yield > 0:
+                prioritized_items.append(item)
+            else:
+                logger.info(f"{item.item_id} is already complete, skipping")
+        print(
+            f"Skipping {len(self.items) - len(prioritized_items)} "
+            f"items that are already complete"
+        )
+        # sorted() is stable so items with equal yield keep the query order
+        return sorted(
+            prioritized_items, key=lambda item: item.expected_yield, reverse=True
+        )
+
+    def set_available_language_counts(self):
+        """Cap the expected yield of acts seen before. The pending
+        languages are the most recent so they win over the titles
+        that were stored for the act."""
+        counts = self.title_corpus.get_language_counts()
+        self.cursor.execute("SELECT celex_id, disabled FROM pending_languages")
+        for celex_id, disabled in self.cursor.fetchall():
+            counts[celex_id] = len(EU_LANGUAGES) - len(disabled.split(","))
+        for item in self.items:
+            if item.celex_id in counts:
+                item.available_language_count = counts[item.celex_id]
 
     def iterate_items(self):
         count = 0
-        for item in self.items:
+        for items in self.group_by_celex(items=self.prioritize_items()).values():
             if count >= self.max:
                 print("Reached max number of items to work on. Stopping")
                 break
             else:
-                item_id = int(item.item_id[1:])
-                if not self.already_processed(item_id=item_id):
-                    print(f"Processing item {count+1}")
-                    item.start()
-                    self.add_item_id_to_database(item_id=item_id)
-                    count += 1
-                    # exit()
-                else:
-                    print(f"{item.item_id} has already been processed")
+                unprocessed_items = []
+                for item in items:
+                    if self.already_processed(item_id=int(item.item_id[1:])):
+                        print(f"{item.item_id} has already been processed")
+                    else:
+                        unprocessed_items.append(item)
+                # an act can have more items than are left to work on
+                unprocessed_items = unprocessed_items[: self.max - count]
+                if unprocessed_items:
+                    print(
+                        f"Processing item {count+1} with CELEX id "
+                        f"{items[0].celex_id} and expected yield "
+                        f"{unprocessed_items[0].expected_yield}"
+                    )
+                    self.process_items(items=unprocessed_items)
+                    count += len(unprocessed_items)
 
     def already_processed(self, item_id) -> bool:
         self.cursor.execute(
@@ -88,6 +394,18 @@ class EurlexScraper(BaseModel):
         count = self.cursor.fetchone()[0]
         return bool(count > 0)
 
+    @staticmethod
+    def get_count(result: dict, key: str) -> int:
+        # the key is missing when the OPTIONAL did not match
+        if key in result:
+            return int(result[key]["value"])
+        return 0
+
+    @staticmethod
+    def now(delta: timedelta = timedelta()) -> str:
+        # this is the xsd:dateTime format used by the query service
+        return (datetime.now(timezone.utc) + delta).strftime("%Y-%m-%dT%H:%M:%SZ")
+
     @staticmethod
     def get_stripped_qid(item_id: str) -> str:
         return item_id.replace("http://www.wikidata.org/entity/", "")
@@ -117,6 +435,47 @@ class EurlexScraper(BaseModel):
         """
         )
 
+        # Create a table with the latest dateModified seen in watch mode
+        self.cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS watermark (
+                name TEXT PRIMARY KEY,
+                value TEXT
+            )
+        """
+        )
+
+        # Create a table with when an item was last processed
+        # and the error if that failed
+        self.cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS item_state (
+                item_id INTEGER PRIMARY KEY,
+                processed_at TEXT,
+                error TEXT
+            )
+        """
+        )
+
+        # Create a table with the languages that were disabled on Eur-Lex
+        # when we processed an item so we can check them again in watch mode
+        self.cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS pending_languages (
+                item_id INTEGER PRIMARY KEY,
+                celex_id TEXT,
+                disabled TEXT,
+                first_seen TEXT,
+                checked TEXT
+            )
+        """
+        )
+        self.cursor.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_checked ON pending_languages (checked)
+        """
+        )
+
         # Commit changes and close the connection
         self.conn.commit()
 
@@ -129,14 +488,82 @@ class EurlexScraper(BaseModel):
         )
         self.conn.commit()
 
+    def get_watermark(self) -> str:
+        self.cursor.execute("SELECT value FROM watermark WHERE name = 'modified'")
+        row = self.cursor.fetchone()
+        if row:
+            return row[0]
+        # the batch mode takes care of the items that existed before
+        watermark = self.now()
+        self.set_watermark(value=watermark)
+        return watermark
+
+    def set_watermark(self, value: str):
+        self.cursor.execute(
+            "INSERT OR REPLACE INTO watermark (name, value) VALUES ('modified', ?)",
+            (value,),
+        )
+        self.conn.commit()
+
+    def get_item_state(self, item: LawItem) -> tuple | None:
+        """Return (processed_at, error) or None if we never tried the item"""
+        self.cursor.execute(
+            "SELECT processed_at, error FROM item_state WHERE item_id = ?",
+            (int(item.item_id[1:]),),
+        )
+        return self.cursor.fetchone()
+
+    def set_item_state(self, item: LawItem, error: str | None = None):
+        self.cursor.execute(
+            """
+            INSERT OR REPLACE INTO item_state (item_id, processed_at, error)
+            VALUES (?, ?, ?)
+        """,
+            (int(item.item_id[1:]), self.now(), error),
+        )
+        self.conn.commit()
+
+    def update_pending_languages(self, item: LawItem):
+        if not item.disabled_languages_fetched:
+            # an empty set does not mean all languages are published
+            logger.info(f"Languages of {item.celex_id} are unknown, keeping them")
+            return
+        item_id = int(item.item_id[1:])
+        if item.disabled_languages:
+            self.cursor.execute(
+                """
+                INSERT INTO pending_languages
+                (item_id, celex_id, disabled, first_seen, checked)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (item_id) DO UPDATE
+                SET disabled = excluded.disabled, checked = excluded.checked
+            """,
+                (
+                    item_id,
+                    item.celex_id,
+                    ",".join(sorted(item.disabled_languages)),
+                    self.now(),
+                    self.now(),
+                ),
+            )
+        else:
+            self.cursor.execute(
+                "DELETE FROM pending_languages WHERE item_id = ?", (item_id,)
+            )
+        self.conn.commit()
+
     def get_count_of_done_item_ids(self):
         self.cursor.execute("SELECT COUNT(item_id) FROM processed")
         count = self.cursor.fetchone()[0]
         print(f"{count} item_ids found in the database")
 
 
-wbi = WikibaseIntegrator(
-    login=Login(user=config.user_name, password=config.bot_password)
-)
-scraper = EurlexScraper(wbi=wbi, max=10)
-scraper.start()
+if __name__ == "__main__":
+    wbi = WikibaseIntegrator(
+        login=Login(user=config.user_name, password=config.bot_password)
+    )
+    scraper = EurlexScraper(wbi=wbi, max=10)
+    if config.watch:
+        scraper.watch()
+    else:
+        scraper.start()
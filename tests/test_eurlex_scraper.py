@@ -0,0 +1,247 @@
+import sqlite3
+
+import pytest
+from wikibaseintegrator import WikibaseIntegrator
+
+import scrape_names
+from models.law_item import LawItem, Euid_not_found
+from models.title import Title
+from scrape_names import EurlexScraper
+
+
+class Calls(list):
+    """The recorded calls and the items that fail when enriched"""
+
+    failing_item_ids: set
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    """Replace Eur-Lex and Wikidata with stubs that record the calls"""
+    calls = Calls()
+
+    def scrape(self):
+        calls.append(("scrape", self.celex_id))
+        self.disabled_languages_fetched = True
+
+    def enrich(self):
+        calls.append(("enrich", self.item_id))
+        if self.item_id in failing_item_ids:
+            raise Euid_not_found(self.item_id)
+
+    failing_item_ids = set()
+    monkeypatch.setattr(LawItem, "scrape", scrape)
+    monkeypatch.setattr(LawItem, "enrich", enrich)
+    monkeypatch.setattr(EurlexScraper, "fetch_counts", lambda self: None)
+    calls.failing_item_ids = failing_item_ids
+    return calls
+
+
+@pytest.fixture
+def scraper(calls):
+    scraper = EurlexScraper(wbi=WikibaseIntegrator(), max=10, max_backlog=2)
+    scraper.title_corpus.path = ":memory:"
+    scraper.conn = sqlite3.connect(":memory:")
+    scraper.get_cursor()
+    scraper.create_db()
+    scraper.title_corpus.connect()
+    yield scraper
+    scraper.http_pool.close()
+
+
+def stub_query(monkeypatch, rows):
+    """rows are (item_id, celex_id, modified)"""
+    bindings = [
+        {
+            "item": {"value": f"http://www.wikidata.org/entity/{item_id}"},
+            "celex_id": {"value": celex_id},
+            "modified": {"value": modified},
+        }
+        for item_id, celex_id, modified in rows
+    ]
+    monkeypatch.setattr(
+        scrape_names,
+        "execute_sparql_query",
+        lambda query: {"results": {"bindings": bindings}},
+    )
+
+
+class TestEurlexScraper:
+    def test_full_backlog_moves_watermark_to_oldest_deferred_item(
+        self, scraper, calls, monkeypatch
+    ):
+        stub_query(
+            monkeypatch,
+            [
+                ("Q1", "A", "2024-01-01T00:00:03Z"),
+                ("Q2", "B", "2024-01-01T00:00:01Z"),
+                ("Q3", "C", "2024-01-01T00:00:02Z"),
+                ("Q4", "D", "2024-01-01T00:00:04Z"),
+            ],
+        )
+        scraper.poll()
+        assert [call for call in calls if call[0] == "enrich"] == [
+            ("enrich", "Q1"),
+            ("enrich", "Q2"),
+        ]
+        assert scraper.get_watermark() == "2024-01-01T00:00:02Z"
+
+    def test_watermark_moves_to_newest_item(self, scraper, calls, monkeypatch):
+        stub_query(monkeypatch, [("Q1", "A", "2024-01-01T00:00:03Z")])
+        scraper.poll()
+        assert scraper.get_watermark() == "2024-01-01T00:00:03Z"
+
+    def test_changed_item_is_processed_again(self, scraper, calls, monkeypatch):
+        stub_query(monkeypatch, [("Q1", "A", "2024-01-01T00:00:00Z")])
+        scraper.poll()
+        processed_at, _ = scraper.get_item_state(
+            item=scraper.get_law_item(item_id="Q1", celex_id="A")
+        )
+        # our own edit is older than processed_at
+        stub_query(monkeypatch, [("Q1", "A", processed_at)])
+        calls.clear()
+        scraper.poll()
+        assert calls == []
+        # somebody else edited the item afterwards
+        stub_query(monkeypatch, [("Q1", "A", "2099-01-01T00:00:00Z")])
+        scraper.poll()
+        assert calls == [("scrape", "A"), ("enrich", "Q1")]
+
+    def test_failed_group_records_error_for_unfinished_items(
+        self, scraper, calls, monkeypatch
+    ):
+        calls.failing_item_ids.add("Q2")
+        stub_query(
+            monkeypatch,
+            [
+                ("Q1", "A", "2024-01-01T00:00:00Z"),
+                ("Q2", "A", "2024-01-01T00:00:00Z"),
+                ("Q3", "A", "2024-01-01T00:00:00Z"),
+            ],
+        )
+        scraper.max_backlog = 10
+        scraper.poll()
+        states = {
+            item_id: scraper.get_item_state(
+                item=scraper.get_law_item(item_id=item_id, celex_id="A")
+            )[1]
+            for item_id in ["Q1", "Q2", "Q3"]
+        }
+        assert states["Q1"] is None
+        assert "Q2" in states["Q2"]
+        assert "Q2" in states["Q3"]
+        # the failure does not stop the watermark
+        assert scraper.get_watermark() == "2024-01-01T00:00:00Z"
+        calls.clear()
+        scraper.poll()
+        assert calls == []
+
+    def test_old_pending_languages_are_dropped(self, scraper, calls, monkeypatch):
+        def get_disabled_languages(self):
+            self.disabled_languages = {"ga"}
+            self.disabled_languages_fetched = True
+
+        monkeypatch.setattr(LawItem, "get_disabled_languages", get_disabled_languages)
+        scraper.cursor.executemany(
+            """
+            INSERT INTO pending_languages
+            (item_id, celex_id, disabled, first_seen, checked)
+            VALUES (?, ?, 'ga', ?, ?)
+        """,
+            [
+                (1, "A", "2000-01-01T00:00:00Z", "2000-01-01T00:00:00Z"),
+                (2, "B", scraper.now(), scraper.now()),
+            ],
+        )
+        scraper.recheck_disabled_languages()
+        scraper.cursor.execute("SELECT item_id FROM pending_languages")
+        assert scraper.cursor.fetchall() == [(2,)]
+        assert calls == []
+
+    def test_unanswered_recheck_keeps_pending_languages(
+        self, scraper, calls, monkeypatch
+    ):
+        monkeypatch.setattr(LawItem, "get_disabled_languages", lambda self: None)
+        scraper.cursor.execute(
+            """
+            INSERT INTO pending_languages
+            (item_id, celex_id, disabled, first_seen, checked)
+            VALUES (1, 'A', 'ga,mt', ?, ?)
+        """,
+            (scraper.now(), scraper.now()),
+        )
+        scraper.recheck_disabled_languages()
+        scraper.cursor.execute("SELECT disabled FROM pending_languages")
+        assert scraper.cursor.fetchall() == [("ga,mt",)]
+        assert calls == []
+
+    def test_prioritize_items(self, scraper):
+        for item_id, titles, labels in [
+            ("Q1", 20, 24),
+            ("Q2", 0, 0),
+            ("Q3", 24, 24),
+            ("Q4", 24, 20),
+        ]:
+            item = scraper.get_law_item(item_id=item_id, celex_id=item_id)
+            item.wikidata_title_count = titles
+            item.wikidata_label_count = labels
+            scraper.items.append(item)
+        assert [item.item_id for item in scraper.prioritize_items()] == [
+            "Q2",
+            "Q1",
+            "Q4",
+        ]
+
+    def test_prioritize_items_caps_yield_by_known_languages(self, scraper):
+        scraper.title_corpus.add_titles(
+            titles=[
+                Title(language=language, value="Directive 88/610/EEC", celex_id="A")
+                for language in ["en", "de"]
+            ]
+        )
+        scraper.cursor.execute(
+            """
+            INSERT INTO pending_languages
+            (item_id, celex_id, disabled, first_seen, checked)
+            VALUES (2, 'B', 'ga,mt', ?, ?)
+        """,
+            (scraper.now(), scraper.now()),
+        )
+        for item_id, celex_id in [("Q1", "A"), ("Q2", "B"), ("Q3", "C")]:
+            item = scraper.get_law_item(item_id=item_id, celex_id=celex_id)
+            item.wikidata_title_count = 2
+            item.wikidata_label_count = 2
+            scraper.items.append(item)
+        assert {
+            item.item_id: item.expected_yield for item in scraper.prioritize_items()
+        } == {"Q3": 44, "Q2": 40}
+
+    def test_items_of_one_act_are_scraped_once(self, scraper, calls, monkeypatch):
+        stub_query(
+            monkeypatch,
+            [("Q1", "A", ""), ("Q2", "A", ""), ("Q3", "B", "")],
+        )
+        scraper.fetch_items()
+        scraper.iterate_items()
+        assert calls == [
+            ("scrape", "A"),
+            ("enrich", "Q1"),
+            ("enrich", "Q2"),
+            ("scrape", "B"),
+            ("enrich", "Q3"),
+        ]
+
+    def test_iterate_items_stops_at_max(self, scraper, calls, monkeypatch):
+        stub_query(
+            monkeypatch,
+            [("Q1", "A", ""), ("Q2", "B", ""), ("Q3", "B", "")],
+        )
+        scraper.max = 2
+        scraper.fetch_items()
+        scraper.iterate_items()
+        assert calls == [
+            ("scrape", "A"),
+            ("enrich", "Q1"),
+            ("scrape", "B"),
+            ("enrich", "Q2"),
+        ]
@@ -0,0 +1,61 @@
+import asyncio
+
+from aiohttp import web
+
+from models.http_pool import HttpPool
+
+
+class TestHttpPool:
+    def test_client_session_is_reused(self):
+        pool = HttpPool()
+        first = pool.run(pool.get_client_session())
+        second = pool.run(pool.get_client_session())
+        assert first is second
+        pool.close()
+        assert first.closed
+
+    def test_fetch_soup_is_single_flight(self):
+        requests = []
+
+        async def handler(request):
+            requests.append(request.path)
+            await asyncio.sleep(0.1)
+            return web.Response(text="<p id='title'>Title</p>", content_type="text/html")
+
+        async def fetch_concurrently_and_again(pool):
+            app = web.Application()
+            app.router.add_get("/page", handler)
+            runner = web.AppRunner(app)
+            await runner.setup()
+            site = web.TCPSite(runner, "127.0.0.1", 0)
+            await site.start()
+            port = runner.addresses[0][1]
+            url = f"http://127.0.0.1:{port}/page"
+            soups = await asyncio.gather(*[pool.fetch_soup(url=url) for _ in range(3)])
+            soups.append(await pool.fetch_soup(url=url))
+            await runner.cleanup()
+            return soups
+
+        pool = HttpPool()
+        soups = pool.run(fetch_concurrently_and_again(pool))
+        pool.close()
+        assert requests == ["/page"]
+        assert all(soup is soups[0] for soup in soups)
+        assert soups[0].select_one("p#title").get_text() == "Title"
+
+    def test_cancelled_waiter_does_not_cancel_download(self):
+        async def slow_download(url):
+            await asyncio.sleep(0.1)
+            return url
+
+        async def cancel_one_waiter(pool):
+            first = asyncio.ensure_future(pool.fetch_soup(url="page"))
+            second = asyncio.ensure_future(pool.fetch_soup(url="page"))
+            await asyncio.sleep(0)
+            first.cancel()
+            return await second
+
+        pool = HttpPool()
+        object.__setattr__(pool, "download", slow_download)
+        assert pool.run(cancel_one_waiter(pool)) == "page"
+        pool.close()
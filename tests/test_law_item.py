@@ -1,6 +1,9 @@
 from unittest import TestCase
 
+from wikibaseintegrator import WikibaseIntegrator
+
 from models.law_item import LawItem
+from models.title_corpus import TitleDiff
 
 
 class TestLawItem(TestCase):
@@ -22,3 +25,61 @@ class TestLawItem(TestCase):
             "sl",
             "lv",
         }
+
+    def test_expected_yield(self):
+        li = LawItem(
+            celex_id="",
+            item_id="",
+            wbi=None,
+            edit_groups_hash="",
+            wikidata_title_count=20,
+            wikidata_label_count=24,
+        )
+        assert li.expected_yield == 4
+
+    def test_expected_yield_of_empty_item(self):
+        li = LawItem(celex_id="", item_id="", wbi=None, edit_groups_hash="")
+        assert li.expected_yield == 48
+
+    def test_apply_name_diffs(self):
+        wbi = WikibaseIntegrator()
+        item = wbi.item.new()
+        item.id = "Q1"
+        item.labels.set(language="en", value="Directive 88/610")
+        item.aliases.set(language="en", values=["Council Directive 88/610", "88/610"])
+        written = []
+        wbi.item.get = lambda entity_id: item
+        item.write = lambda summary: written.append(item.get_json())
+        li = LawItem(celex_id="31988L0610", item_id="Q1", wbi=wbi, edit_groups_hash="")
+        li.apply_name_diffs(
+            diffs=[
+                TitleDiff(
+                    celex_id="31988L0610",
+                    item_ids=["Q1"],
+                    language="en",
+                    field=field,
+                    old=old,
+                    new=new,
+                )
+                for field, old, new in [
+                    (
+                        "shortname_without_institution",
+                        "Directive 88/610",
+                        "Directive 88/610/EEC",
+                    ),
+                    (
+                        "shortname_with_institution",
+                        "Council Directive 88/610",
+                        "Council Directive 88/610/EEC",
+                    ),
+                ]
+            ]
+        )
+        assert len(written) == 1
+        assert written[0]["labels"]["en"]["value"] == "Directive 88/610/EEC"
+        assert written[0]["aliases"]["en"] == [
+            {"language": "en", "value": "Council Directive 88/610", "remove": ""},
+            {"language": "en", "value": "88/610"},
+            {"language": "en", "value": "Council Directive 88/610/EEC"},
+        ]
+        assert "claims" not in written[0] or not written[0]["claims"]
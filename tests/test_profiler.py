@@ -0,0 +1,33 @@
+import os
+import re
+
+from models.profiler import Profiler
+
+
+class TestProfiler:
+    def test_disabled_profiler_records_nothing(self):
+        profiler = Profiler()
+        with profiler.stage("stage"):
+            with profiler.allocations_in("section"):
+                sum(range(1000))
+        assert profiler.stages == {}
+        assert profiler.allocations == {}
+
+    def test_write_reports(self, tmp_path):
+        profiler = Profiler(enabled=True, output_dir=str(tmp_path))
+        with profiler.stage("stage"):
+            with profiler.allocations_in("section"):
+                titles = [re.sub("a", "b", f"title {i}") for i in range(1000)]
+        assert len(titles) == 1000
+        assert profiler.stages["stage"].calls == 1
+        assert profiler.allocations["section"]
+        assert profiler.peaks["section"] > 0
+        profiler.write_reports()
+        assert os.path.exists(tmp_path / "stage.prof")
+        assert os.path.exists(tmp_path / "summary.txt")
+        with open(tmp_path / "stage.collapsed") as file:
+            lines = file.read().splitlines()
+        assert lines
+        for line in lines:
+            stack, microseconds = line.rsplit(" ", 1)
+            assert int(microseconds) > 0
@@ -0,0 +1,41 @@
+from models.title import Title
+from models.title_corpus import TitleCorpus
+
+
+class TestTitleCorpus:
+    def get_corpus(self) -> TitleCorpus:
+        corpus = TitleCorpus(path=":memory:")
+        corpus.connect()
+        corpus.add_titles(
+            titles=[
+                Title(
+                    language="en",
+                    value="Council Directive 88/610/EEC of 24 November 1988",
+                    celex_id="31988L0610",
+                )
+            ]
+        )
+        corpus.add_item_ids(celex_id="31988L0610", item_ids=["Q1", "Q2"])
+        return corpus
+
+    def test_rederive_without_changes(self):
+        corpus = self.get_corpus()
+        assert corpus.rederive() == []
+
+    def test_rederive_after_regex_change(self, monkeypatch):
+        corpus = self.get_corpus()
+        monkeypatch.setitem(
+            Title.model_fields["regex_list"].default,
+            "en",
+            r"(^(?P<i>Council )?Directive \d{2}/\d+/EEC)",
+        )
+        diffs = corpus.rederive()
+        assert {diff.field for diff in diffs} == {
+            "shortname_with_institution",
+            "shortname_without_institution",
+        }
+        assert all(diff.item_ids == ["Q1", "Q2"] for diff in diffs)
+        new_names = {diff.field: diff.new for diff in diffs}
+        assert new_names["shortname_without_institution"] == "Directive 88/610/EEC"
+        corpus.save_diffs(diffs=diffs)
+        assert corpus.rederive() == []